@@ -8,7 +8,31 @@ Usage:
 This module can be used to load gene expression data, get gene names and their expression values.
 
 """
-from collections import defaultdict
+import os
+import sys
+import zipfile
+
+import numpy as np
+
+# Polars and pandas are optional. The file is parsed with polars if it's installed,
+# then with pandas, and with NumPy's own reader if neither of them is installed
+try:
+    import polars as pl
+except ImportError:
+    pl = None
+
+try:
+    import pandas as pd
+except ImportError:
+    pd = None
+
+# Roughly how many values are parsed in each batch when streaming the data file
+BATCH_VALUES = 5_000_000
+
+# Codes of the sample statuses in GeneExpressionData.status_codes
+NORMAL_CODE = 0
+HCC_CODE = 1
+OTHER_CODE = 2
 
 
 class GeneExpressionData:
@@ -22,51 +46,273 @@ class GeneExpressionData:
 
     """
 
-    def __init__(self, file_path):
+    def __init__(self, file_path, use_cache=True):
         """
         Initialize the GeneExpressionData class with a file path to the data file.
 
+        Param:
+         - use_cache: If True, the parsed data is saved next to the data file
+           (as <file_path>.cache.npz) and later loads read it instead of the CSV.
         """
         self.file_path = file_path
+        self.use_cache = use_cache
+        self.cache_path = f"{file_path}.cache.npz"
 
-        # Two attributes to load the information in
-        self.gene_expression_values = defaultdict(list)
+        # The data is kept as a structure of arrays: one (samples x genes) matrix
+        # of expression values, plus the sample names and statuses shared by all genes.
+        # The matrix is stored column by column (Fortran order), so each gene's
+        # values sit next to each other in memory, like one array per gene
+        self.values = np.empty((0, 0), order='F')
+        self.samples = np.empty(0, dtype=object)
+        self.statuses = np.empty(0, dtype=object)
+        self.status_codes = np.empty(0, dtype=np.uint8)
         self.gene_names = []
 
-    def load_data(self):
+        # Maps each gene name to its column in self.values
+        self.gene_index = {}
+
+    def load_data(self, genes=None):
         """
         Load gene expression data from the file into memory.
         This method is run in the main script, to make sure
         there's no error when reading the file.
 
+        Param:
+         - genes: Optional list of the gene names that are needed. If it's given,
+           only those gene columns are parsed and gene_names only contains the ones
+           found in the file. By default all the genes are loaded.
+
         Output: 
          - Error message and exiting the script if the file's not found
-         - Loading the data into gene_expression_values and gene_names if there's no error
+         - Loading the data into values, samples, statuses and gene_names if there's no error
         """
         try:
-            with open(self.file_path, 'r', encoding='utf-8') as file_handle:
-                # Read header line to get gene names
-                header = file_handle.readline().strip().split(',')
-
-                # Skip the first two elements to get to gene names
-                self.gene_names = header[2:]
-
-                # Extract gene expression data
-                for line in file_handle:
-                    line_parts = line.strip().split(',')
-                    sample, status, *expression_values = line_parts
+            # The size and modification time of the data file, to check the cache is up to date
+            source_stat = os.stat(self.file_path)
+            source_key = np.array([source_stat.st_size, source_stat.st_mtime_ns])
 
-                    # Use map to directly create an iterator, reducing memory usage
-                    expression_values = map(float, expression_values)
+            # A set, since every column name is looked up in it
+            if genes is not None:
+                genes = set(genes)
 
-                    # Save each gene's expression values with its status and sample name for
-                    # Using in the differential statistical analysis
-                    for gene_name, value in zip(self.gene_names, expression_values):
-                        self.gene_expression_values[gene_name].append((sample, status, value))
+            # A valid cache is used even if only some genes are needed, reading
+            # it is faster than parsing those columns from the CSV
+            if not (self.use_cache and self._read_cache(source_key)):
+                if pl is not None:
+                    self._read_with_polars(genes)
+                elif pd is not None:
+                    self._read_with_pandas(genes)
+                else:
+                    self._read_with_numpy(genes)
 
+                # Only a load of all the genes can be reused by later runs
+                if self.use_cache and genes is None:
+                    self._write_cache(source_key)
         except FileNotFoundError as e:
             return f"Error! {e}"
 
+        # There are only a couple of different statuses, interning them makes all
+        # the samples share one string object per status, and comparing a status
+        # with 'HCC' or 'normal' becomes a pointer check
+        self.statuses = np.array([sys.intern(status) for status in self.statuses.tolist()],
+                                 dtype=object)
+
+        # The statuses as one byte per sample (see NORMAL_CODE, HCC_CODE and OTHER_CODE),
+        # the analyses select and count the groups with these instead of comparing strings
+        self.status_codes = np.full(len(self.statuses), OTHER_CODE, dtype=np.uint8)
+        self.status_codes[self.statuses == 'normal'] = NORMAL_CODE
+        self.status_codes[self.statuses == 'HCC'] = HCC_CODE
+
+        self.gene_index = {gene_name: i for i, gene_name in enumerate(self.gene_names)}
+
+    def _read_cache(self, source_key):
+        """
+        Private method to load the arrays saved by a previous load of the same file.
+
+        Return:
+         - True if the cache was loaded, False if there's no cache, it can't be read
+           or it was made from a different version of the file
+        """
+        try:
+            with np.load(self.cache_path) as cache:
+                if not np.array_equal(cache['source_key'], source_key):
+                    return False
+
+                values = cache['values']
+                # Strings are saved as fixed width arrays, turn them back into python strings
+                samples = cache['samples'].astype(object)
+                statuses = cache['statuses'].astype(object)
+                gene_names = cache['gene_names'].tolist()
+        except (OSError, EOFError, ValueError, TypeError, KeyError, zipfile.BadZipFile):
+            # A missing or broken cache (e.g. half written, or not an .npz file at all)
+            # is the same as no cache, the CSV is parsed and the cache is written again
+            return False
+
+        # Nothing is kept unless all the arrays were read
+        self.values = values
+        self.samples = samples
+        self.statuses = statuses
+        self.gene_names = gene_names
+
+        return True
+
+    def _write_cache(self, source_key):
+        """
+        Private method to save the parsed arrays next to the data file,
+        so the next load can skip parsing the CSV.
+        """
+        # Write to a temporary file first, so a cache that's only half
+        # written is never read. Not being able to write it is not an error
+        temp_path = f"{self.cache_path}.tmp"
+        try:
+            with open(temp_path, 'wb') as file_handle:
+                np.savez(file_handle, source_key=source_key, values=self.values,
+                         samples=self.samples.astype(str), statuses=self.statuses.astype(str),
+                         gene_names=np.array(self.gene_names, dtype=str))
+            os.replace(temp_path, self.cache_path)
+        except OSError:
+            # Don't leave the temporary file behind
+            try:
+                os.remove(temp_path)
+            except OSError:
+                pass
+
+    def _gene_columns(self, columns, genes):
+        """
+        Private method to find the positions of the gene columns that should be parsed.
+
+        Params:
+         - columns: All the column names from the file's header.
+         - genes: Set of the gene names that are needed, or None for all of them.
+
+        Return:
+         - a list of column positions, in the order they're in the file
+        """
+        # Skip the first two columns (sample name and status) to get to gene names
+        return [i for i in range(2, len(columns)) if genes is None or columns[i] in genes]
+
+    def _allocate_arrays(self, n_rows):
+        """
+        Private method to allocate the values, samples and statuses
+        arrays for n_rows samples, before they're filled batch by batch.
+        """
+        self.values = np.empty((n_rows, len(self.gene_names)), dtype=np.float64, order='F')
+        self.samples = np.empty(n_rows, dtype=object)
+        self.statuses = np.empty(n_rows, dtype=object)
+
+    def _read_with_polars(self, genes):
+        """
+        Private method to parse the data file with polars.
+        Polars parses the file in native code, so there's no
+        per-line split and no per-value float() call in Python.
+
+        The file is streamed in batches which are copied into preallocated
+        arrays, so the peak memory stays close to the size of the final matrix.
+        The scan is lazy, so columns of genes that aren't needed are skipped by the parser
+        """
+        # Every column is read as a string, types guessed from the first rows would
+        # turn sample names like 002 into numbers, or fail on a gene column whose
+        # first values look like integers. The gene columns are cast to float below
+        lazy_frame = pl.scan_csv(self.file_path, infer_schema=False)
+        columns = lazy_frame.collect_schema().names()
+        sample_column, status_column = columns[0], columns[1]
+
+        gene_columns = self._gene_columns(columns, genes)
+        self.gene_names = [columns[i] for i in gene_columns]
+
+        # Polars keeps a blank line as a row of nulls, the other readers skip it.
+        # Only the columns that are read are checked, so the other genes still aren't parsed
+        lazy_frame = lazy_frame.filter(
+            ~pl.all_horizontal(pl.col(sample_column, status_column, *self.gene_names).is_null()))
+
+        # Count the rows first, so the arrays can be allocated once
+        n_rows = lazy_frame.select(pl.len()).collect().item()
+        self._allocate_arrays(n_rows)
+
+        # The gene values are parsed as floats here, after they're read as strings.
+        # Polars reads an empty field as null, the sample name and status are
+        # kept as empty strings instead, like the other readers do
+        lazy_frame = lazy_frame.select(pl.col(sample_column, status_column).fill_null(''),
+                                       pl.col(self.gene_names).cast(pl.Float64))
+
+        # The number of rows in a batch depends on how many columns are parsed
+        batch_rows = max(1, BATCH_VALUES // (len(gene_columns) + 2))
+
+        offset = 0
+        for batch in lazy_frame.collect_batches(chunk_size=batch_rows):
+            end = offset + batch.height
+            self.samples[offset:end] = batch.get_column(sample_column).to_numpy()
+            self.statuses[offset:end] = batch.get_column(status_column).to_numpy()
+            # A frame without columns has no rows either, there's nothing to copy
+            # when none of the needed genes are in the file
+            if self.gene_names:
+                self.values[offset:end] = batch.select(self.gene_names).to_numpy()
+            offset = end
+
+    def _read_with_pandas(self, genes):
+        """
+        Private method to parse the data file with pandas,
+        used when polars is not installed. The C engine parses the file
+        in chunks which are copied into preallocated arrays, so the whole
+        file is never held in a DataFrame next to the final matrix
+        """
+        # Read the header and count the rows, so the arrays can be allocated once
+        with open(self.file_path, 'rb') as file_handle:
+            header = file_handle.readline().decode('utf-8').strip().split(',')
+            n_rows = sum(1 for _ in file_handle)
+
+        gene_columns = self._gene_columns(header, genes)
+        self.gene_names = [header[i] for i in gene_columns]
+        self._allocate_arrays(n_rows)
+
+        # The number of rows in a chunk depends on how many columns are parsed
+        chunk_rows = max(1, BATCH_VALUES // (len(gene_columns) + 2))
+
+        # Sample names and statuses are kept as they're written in the file,
+        # so 002 isn't turned into a number and an empty status isn't turned into NaN
+        offset = 0
+        with pd.read_csv(self.file_path, engine='c', chunksize=chunk_rows,
+                         usecols=[0, 1, *gene_columns], dtype={header[0]: str, header[1]: str},
+                         keep_default_na=False) as reader:
+            for chunk in reader:
+                end = offset + len(chunk)
+                self.samples[offset:end] = chunk.iloc[:, 0].to_numpy(dtype=object)
+                self.statuses[offset:end] = chunk.iloc[:, 1].to_numpy(dtype=object)
+                self.values[offset:end] = chunk.iloc[:, 2:].to_numpy(dtype=np.float64)
+                offset = end
+
+        # Blank lines are counted above, but pandas skips them
+        self.values = self.values[:offset]
+        self.samples = self.samples[:offset]
+        self.statuses = self.statuses[:offset]
+
+    def _read_with_numpy(self, genes):
+        """
+        Private method to parse the data file with numpy.loadtxt,
+        used when neither polars nor pandas is installed. The tokenizer and the
+        float conversion both run in C.
+        """
+        with open(self.file_path, 'r', encoding='utf-8') as file_handle:
+            # Read header line to get gene names and the number of columns
+            header = file_handle.readline().strip().split(',')
+
+            # Sample name and status are the first two fields of every line.
+            # Splitting with maxsplit=2 stops there, instead of having loadtxt
+            # tokenize every value on the line just to keep two of them
+            sample_status = [line.split(',', 2)[:2] for line in file_handle
+                             if not line.isspace()]
+
+        gene_columns = self._gene_columns(header, genes)
+        self.gene_names = [header[i] for i in gene_columns]
+
+        values = np.loadtxt(self.file_path, delimiter=',', skiprows=1,
+                            usecols=gene_columns, dtype=np.float64, ndmin=2)
+        self.values = np.asfortranarray(values)
+
+        sample_status = np.array(sample_status, dtype=object).reshape(-1, 2)
+        self.samples = sample_status[:, 0]
+        self.statuses = sample_status[:, 1]
+
 
     def get_gene_names(self):
         """
@@ -78,6 +324,26 @@ class GeneExpressionData:
         """
         return self.gene_names
 
+    def get_sample_array(self):
+        """
+        Returns the sample names as a numpy array, in the same order as the rows of values.
+        """
+        return self.samples
+
+    def get_status_array(self):
+        """
+        Returns the status (HCC or normal) of each sample as a numpy array,
+        in the same order as the rows of values.
+        """
+        return self.statuses
+
+    def get_status_codes(self):
+        """
+        Returns the status of each sample as a numpy array of codes
+        (NORMAL_CODE, HCC_CODE or OTHER_CODE), in the same order as the rows of values.
+        """
+        return self.status_codes
+
     def get_expression_values(self, gene_name):
         """
         Given a gene name, return its expression values across different samples.
@@ -86,13 +352,14 @@ class GeneExpressionData:
          - gene_name: The name of the gene.
 
         Return: 
-         - a list containing expression values.
+         - a numpy array containing expression values.
+           It's a view into the data (nothing is copied), so it shouldn't be modified.
         """
-        if gene_name not in self.gene_names:
+        # gene_index is a dict, so this is a hash lookup instead of a scan of the gene names list
+        if gene_name not in self.gene_index:
             # Since this error can be caught easily
             # I didn't write a custom error class for it
             return f"Gene {gene_name} not found in data."
-        # Use list comprehension to get only the values and not the status and sample name
-        return [sample_status_value[2] for sample_status_value\
-                 in self.gene_expression_values[gene_name]]
+        # The gene's column holds its value for every sample
+        return self.values[:, self.gene_index[gene_name]]
     
\ No newline at end of file
@@ -86,10 +86,25 @@ def main():
     # Load gene expression data
     gene_data = GeneExpressionData(args.data_file)
 
+    # Only the genes named in the arguments have to be parsed, unless one of
+    # the requested analyses goes through all the genes
+    if args.get_all_gene_names or args.top_n or \
+       (args.threshold and not args.genes_above_threshold):
+        needed_genes = None
+    else:
+        needed_genes = set()
+        for gene_names in (args.statistics, args.differential, args.genes_above_threshold):
+            if gene_names:
+                needed_genes.update(gene_names)
+        if args.gene_name:
+            needed_genes.add(args.gene_name)
+
     # This is to catch the FileNotFound error and to terminate the script
-    # If there's no error, the attributes gene_names and gene_expression_values are set
-    if isinstance(gene_data.load_data(), str):
-        sys.exit(gene_data.load_data())
+    # If there's no error, the data attributes (gene_names, values, ...) are set
+    # The result is kept so the file is only read once
+    load_error = gene_data.load_data(needed_genes)
+    if isinstance(load_error, str):
+        sys.exit(load_error)
 
     # Initialize StatisticalAnalysis with the gene expression data instance
     stats_analysis = StatisticalAnalysis(gene_data)
@@ -102,16 +117,16 @@ def main():
     # Add destination
     if args.add:
         report.add_destination(args.add)
-        # Using a for loop since args.add is a list of arguments
-        for path in args.add:
-            print(f"Destination {path} added.")
+        # args.add is a list of arguments, the messages are joined
+        # so they're written with a single call
+        sys.stdout.write("".join(f"Destination {path} added.\n" for path in args.add))
 
      # Remove destination
     if args.remove:
         report.remove_destination(args.remove)
-        # Using a for loop since arg.remove is a list of arguments
-        for path in args.remove:
-            print(f"Destination {path} removed.")
+        # args.remove is a list of arguments, the messages are joined
+        # so they're written with a single call
+        sys.stdout.write("".join(f"Destination {path} removed.\n" for path in args.remove))
 
     # Check to see if a destination is present in the list of destinations
     if args.check:
@@ -136,11 +151,11 @@ def main():
         gene_exps = gene_data.get_expression_values(args.gene_name)
 
         # If the gene name doesn't exist, we print the error message
-        if isinstance(gene_exps, list):
-            report.append_gene_exp(args.gene_name, gene_exps)
+        if isinstance(gene_exps, str):
+            print(gene_exps)
 
         else:
-            print(gene_exps)
+            report.append_gene_exp(args.gene_name, gene_exps)
 
 
     # Perform statistical analysis if requested
@@ -186,8 +201,9 @@ def main():
             print(threshold_results)
 
 
-    # Generate the report
-    report.output_report()
+    # Generate the report, the with statement closes any files it was written to
+    with report:
+        report.output_report()
 
 # Executes main only if the script is directly executed
 # Not when it's imported
@@ -1,8 +1,12 @@
 """
 This module is for the purpose of generating an analysis report.
 """
+import io
+import sys
 from datetime import datetime
 
+import numpy as np
+
 class AnalysisReport:
 
     """
@@ -17,6 +21,11 @@ class AnalysisReport:
 
     """
 
+    # Separator line, header and footer used in every report
+    _SEP = "=" * 50
+    _HEADER = f"{_SEP}\nANALYSIS REPORT\n{_SEP}"
+    _FOOTER = f"{_SEP}\nEND OF REPORT\n{_SEP}"
+
     def __init__(self, *output_destinations):
 
         """
@@ -27,26 +36,47 @@ class AnalysisReport:
         """
 
         # The *arg output_destinations is saved as a tuple
-        # Should be a list for additional add and remove methods
-        self.output_destinations = list(output_destinations)
+        # It's kept as a dict (with None values) for the additional add, remove and
+        # contains methods, a dict has O(1) lookups and still keeps the insertion order
+        # File names are stored with their .txt extension (see _normalize_destination)
+        self.output_destinations = dict.fromkeys(map(self._normalize_destination,
+                                                     output_destinations))
+        # Each result is a (title, text) tuple
         self.analysis_results = []
+
+        # Open file handles, keyed by file name. Files are opened on their
+        # first write and stay open until close() is called
+        self._handles = {}
     
 
 
+    @staticmethod
+    def _normalize_destination(destination):
+        """
+        Private method to make sure a file name has a .txt extension.
+        Destinations are normalized once when they're added,
+        instead of checking the file name on every write.
+        """
+        if destination == 'screen' or destination.endswith('.txt'):
+            return destination
+        return destination + ".txt"
+
     def _write_to_screen(self, content):
 
         """Private method to output content to the screen."""
 
-        print(content)
-
-    def _write_to_file(self, filename, content):
-        """Private method to write content to a file."""
-        # Make sure file name has a .txt extension
-        if filename[-4:] != '.txt':
-            filename = filename+".txt"
+        # A single write, print would write the content and the newline separately
+        sys.stdout.write(f"{content}\n")
 
-        with open(filename, 'a', encoding='utf-8') as file:
-            file.write(content + '\n')
+    def _file_stream(self, filename):
+        """Private method to get the open stream of a file destination."""
+        # Only the first report to a file opens it, later reports reuse the handle.
+        # The binary file has a 1 MiB buffer, so a whole report usually
+        # reaches the disk in a single write when it's flushed
+        if filename not in self._handles:
+            self._handles[filename] = io.TextIOWrapper(open(filename, 'ab', buffering=1 << 20),
+                                                       encoding='utf-8')
+        return self._handles[filename]
 
     def append_gene_names(self, gene_names):
         """
@@ -60,21 +90,22 @@ class AnalysisReport:
         """
         # For display purposes
         gene_names = ', '.join(gene_names)
-        self.analysis_results.append({"Gene Names Are": gene_names})
+        self.analysis_results.append(("Gene Names Are", gene_names))
 
     def append_gene_exp(self, gene_name, gene_exps):
         """
         Appends gene expression values to the analysis results.
 
         Parameters:
-            gene_exps (list of float): List of expression values for a specific gene.
+            gene_exps (numpy array or list of float): Expression values for a specific gene.
 
         Returns:
             None
         """
-        # For display purposes
-        gene_exps = ', '.join(map(str, gene_exps))
-        self.analysis_results.append({f"The {gene_name} expression values": f"{gene_exps}"})
+        # For display purposes. The values are turned into python floats in one call
+        # first, str() on numpy scalars one at a time is much slower
+        gene_exps = ', '.join(map(str, np.asarray(gene_exps).tolist()))
+        self.analysis_results.append((f"The {gene_name} expression values", f"{gene_exps}"))
 
     def append_stats(self, genes_stat_info):
         """
@@ -93,10 +124,10 @@ class AnalysisReport:
         for gene, info in genes_stat_info.items():
 
         # THE INDENTATION OF FSTRING IS FOR DISPLAY PURPOSES
-                self.analysis_results.append({f"Gene Name: {gene}": f"""
+                self.analysis_results.append((f"Gene Name: {gene}", f"""
 Expression Mean: {info['mean']}
 Expression Stdev: {info['stdev']}
-Expression Median: {info['median']}"""})
+Expression Median: {info['median']}"""))
                 
     def append_diff(self, differential):
         """
@@ -110,7 +141,7 @@ Expression Median: {info['median']}"""})
             None
         """
         for gene, diff in differential.items():
-            self.analysis_results.append({f"Difference of Means for {gene} gene between normal and hcc groups": f"{diff}"})
+            self.analysis_results.append((f"Difference of Means for {gene} gene between normal and hcc groups", f"{diff}"))
 
     def append_top(self, n, top_genes):
         """
@@ -127,13 +158,13 @@ Expression Median: {info['median']}"""})
         """
         i = 0
         # This is to create a title for this section
-        self.analysis_results.append({f'Top {n} Genes': ''})
+        self.analysis_results.append((f'Top {n} Genes', ''))
 
         for top in top_genes:
             i+=1
             # Remember we had to change the order of gene name
             # and difference value for qheap to work, the order is: (value, name)
-            self.analysis_results.append({f"No.{i}) Gene Name: {top[1]}": f"Absolute Mean Difference: {top[0]}"})
+            self.analysis_results.append((f"No.{i}) Gene Name: {top[1]}", f"Absolute Mean Difference: {top[0]}"))
 
     def append_thrsh(self, threshold_results):
         """
@@ -143,9 +174,9 @@ Expression Median: {info['median']}"""})
         Parameters:
             threshold_results (dict): A dictionary where keys are gene names and values are either:
                                     - A string message indicating no values above the threshold.
-                                    - A dictionary containing:
-                                        - 'info': A list of tuples (sample, status, value).
-                                        - 'hcc_percentage': Percentage of HCC samples above the threshold.
+                                    - A ThresholdResult containing:
+                                        - info: A list of tuples (sample, status, value).
+                                        - hcc_percentage: Percentage of HCC samples above the threshold.
 
         Returns:
             None
@@ -155,19 +186,19 @@ Expression Median: {info['median']}"""})
             # If there are no expressions above threshold
             # we'll have a string as the value for the gene in its dictionary
             if isinstance(info, str):
-                self.analysis_results.append({f'For Gene {gene}': f'{info}'})
+                self.analysis_results.append((f'For Gene {gene}', f'{info}'))
 
             else:
                 # The next four lines are written for better display of the results
-                self.analysis_results.append({f'For Gene {gene}': ''})
+                self.analysis_results.append((f'For Gene {gene}', ''))
 
-                # Iterate through every tuple of (sample, status, value) and create a dict
+                # Iterate through every tuple of (sample, status, value) and create a (title, text) tuple
                 # to append to the results list so that we can display each sample's info
                 # In a single line.
-                for data in info['info']:
-                    self.analysis_results.append({f':{data[0]}': f'{data[1]} {data[2]}'})
+                for data in info.info:
+                    self.analysis_results.append((f':{data[0]}', f'{data[1]} {data[2]}'))
 
-                self.analysis_results.append({f'HCC Percentage For Gene {gene}': info['hcc_percentage']})
+                self.analysis_results.append((f'HCC Percentage For Gene {gene}', info.hcc_percentage))
 
     def output_report(self):
         """
@@ -175,28 +206,57 @@ Expression Median: {info['median']}"""})
 
         """
         # Create formatted report with headers, footers, date and time
-        header = "=" * 50 + "\nANALYSIS REPORT\n" + "=" * 50
         timestamp = f"Report generated on: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}"
-        footer = "=" * 50 + "\nEND OF REPORT\n" + "=" * 50
 
-        body = ""
         if self.analysis_results:
-            for analysis in self.analysis_results:
-                for key, value in analysis.items():
-                    body += f"{key}: {value}\n\n"
-
-            report_content = f"{header}\n{timestamp}\n\n{body}\n{footer}\n\n"
-
-            # Write to all specified destinations
-            for destination in self.output_destinations:
-                if destination == 'screen':
-                    self._write_to_screen(report_content)
-                else:
-                    self._write_to_file(destination, report_content)
+            # Every piece of the report goes straight to the buffered files.
+            # The screen's pieces are collected and written with a single write at
+            # the end, on a terminal stdout would flush each of them separately
+            screen = io.StringIO()
+            streams = [screen if destination == 'screen' else self._file_stream(destination)
+                       for destination in self.output_destinations]
+
+            def write(text):
+                for stream in streams:
+                    stream.write(text)
+
+            write(f"{self._HEADER}\n{timestamp}\n\n")
+            for key, value in self.analysis_results:
+                write(f"{key}: {value}\n\n")
+            write(f"\n{self._FOOTER}\n\n\n")
+
+            if 'screen' in self.output_destinations:
+                sys.stdout.write(screen.getvalue())
+
+            # The files stay open for later reports, but this report
+            # shouldn't wait in their buffers until they're closed
+            for file in self._handles.values():
+                file.flush()
         else:
             self._write_to_screen("No analysis was performed. Please provide arguments to perform an analysis.")
 
+    def close(self):
+        """
+        Close all the files the report has written to.
+        """
+        for file in self._handles.values():
+            file.close()
+        self._handles.clear()
+
     # Additional Methods
+    def __enter__(self):
+        """
+        Allows using the report in a with statement,
+        so its files are closed at the end of the block.
+        """
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        """
+        Close the report's files when leaving the with statement.
+        """
+        self.close()
+
     def __str__(self):
         """
         String representation of the AnalysisReport object.
@@ -212,7 +272,7 @@ Expression Median: {info['median']}"""})
         destination is in the output destinations list.
         Return: Boolean value True if item is among the list
         """
-        return item in self.output_destinations
+        return self._normalize_destination(item) in self.output_destinations
 
 
     def add_destination(self, destinations):
@@ -220,9 +280,10 @@ Expression Median: {info['median']}"""})
         Add a new destination to the output destinations list.
         Param: destination: The new destination to add.
         """
-        for destination in destinations:
-            if destination not in self.output_destinations:
-                self.output_destinations.append(destination)
+        # All the destinations are inserted in one call, the ones
+        # already there keep their place in the order
+        self.output_destinations.update(dict.fromkeys(map(self._normalize_destination,
+                                                          destinations)))
 
 
     def remove_destination(self, destinations):
@@ -231,5 +292,5 @@ Expression Median: {info['median']}"""})
         Param: destination: The destination to remove.
         """
         for destination in destinations:
-            if destination in self.output_destinations:
-                self.output_destinations.remove(destination)
+            # Does nothing if the destination isn't there
+            self.output_destinations.pop(self._normalize_destination(destination), None)
@@ -4,6 +4,8 @@ Module for Statistical Analysis of a Gene Expression Data class instance
 This module contains the following classes:
 - NoGeneName: A custom error class
 
+- ThresholdResult: The samples of a gene above a threshold and their hcc percentage.
+
 - StatisticalAnalysis: Contains methods to statistically analyze the gene expression data.
 
 Usage:
@@ -17,9 +19,18 @@ This module can be used to:
 
 """
 
-from statistics import mean, stdev, median
-import heapq as hq # part of the standard library, implements min heap on top of a regular list
-from collections import defaultdict
+from collections import defaultdict, namedtuple
+
+import numpy as np
+
+from gene_expression_data import NORMAL_CODE, HCC_CODE
+
+
+# Result of expression_above_threshold for a gene with values above the threshold:
+# - info: A list of tuples (sample, status, value).
+# - hcc_percentage: Percentage of HCC samples above the threshold.
+ThresholdResult = namedtuple('ThresholdResult', 'info hcc_percentage')
+
 
 class NoGeneName(Exception):
     """
@@ -54,7 +65,8 @@ class StatisticalAnalysis:
         """
         Private method to make sure that gene names are passed
         """
-        if gene not in self.gene_exp_inst.gene_names:
+        # A hash lookup in gene_index
+        if gene not in self.gene_exp_inst.gene_index:
             raise NoGeneName(f"{gene} Doesn't Exist! Enter The Gene Names Correctly.")
 
 
@@ -82,11 +94,12 @@ class StatisticalAnalysis:
                 self._validate_input(gene)
 
             for gene in genes:
-                exp_values = [sample_status_value[2] for sample_status_value in\
-                               self.gene_exp_inst.gene_expression_values[gene]]
-                gene_stats[gene]['mean'] = mean(exp_values)
-                gene_stats[gene]['stdev'] = stdev(exp_values)
-                gene_stats[gene]['median'] = median(exp_values)
+                exp_values = self.gene_exp_inst.get_expression_values(gene)
+                # NumPy computes these in C over the gene's contiguous column,
+                # ddof=1 gives the sample standard deviation like statistics.stdev
+                gene_stats[gene]['mean'] = exp_values.mean()
+                gene_stats[gene]['stdev'] = exp_values.std(ddof=1)
+                gene_stats[gene]['median'] = np.median(exp_values)
 
             return gene_stats
 
@@ -95,6 +108,31 @@ class StatisticalAnalysis:
 
 
 
+    def _mean_differences(self, columns=slice(None)):
+        """
+        Private method to calculate mean(HCC) - mean(normal) for gene columns.
+        Only the rows of the two groups are averaged, so samples with any
+        other status don't change the result, even if their values are NaN.
+
+        Param:
+         - columns: The columns of the genes in the values matrix, all of them by default.
+
+        Return:
+         - a numpy array of the differences, or None if either group is empty
+        """
+        status_codes = self.gene_exp_inst.get_status_codes()
+        hcc_rows = np.flatnonzero(status_codes == HCC_CODE)
+        normal_rows = np.flatnonzero(status_codes == NORMAL_CODE)
+
+        if not (hcc_rows.size and normal_rows.size):
+            return None
+
+        # The transpose has a row per gene, with the gene's values next to each
+        # other in memory, so each group's values are gathered and averaged gene by gene
+        gene_rows = self.gene_exp_inst.values[:, columns].T
+        return gene_rows[:, hcc_rows].mean(axis=1) - gene_rows[:, normal_rows].mean(axis=1)
+
+
     def calculate_differential(self, *genes):
         """
         Calculate the differential expression of the specified genes between normal and HCC groups.
@@ -113,27 +151,19 @@ class StatisticalAnalysis:
             for gene in genes:
                 self._validate_input(gene)
 
-            diff_dict = {}
             # Make sure there are no repeated genes in the list
-            genes = set(genes)
+            genes = list(set(genes))
 
-            for gene in genes:
-                # Use _ since the first element is sample name and we're not gonna
-                # use it here, but we need it for the for loop
-                normal = [value for _, status, value in \
-                          self.gene_exp_inst.gene_expression_values[gene] \
-                          if status == 'normal']
-
-                hcc = [value for _, status, value in \
-                       self.gene_exp_inst.gene_expression_values[gene] \
-                       if status == 'HCC']
-
-                # To make sure they are not empty
-                if normal and hcc:
-                    diff_dict[gene] = mean(hcc) - mean(normal)
-                else:
-                    diff_dict[gene] = 'Either normal or HCC group is empty'
-            return diff_dict
+            # The genes are valid, so the differences of all of them come from the same
+            # calculation top_n_differential uses, only over the requested columns
+            columns = [self.gene_exp_inst.gene_index[gene] for gene in genes]
+            diffs = self._mean_differences(columns)
+
+            # To make sure the groups are not empty
+            if diffs is None:
+                return {gene: 'Either normal or HCC group is empty' for gene in genes}
+
+            return dict(zip(genes, diffs.tolist()))
 
         except NoGeneName as e:
             return f'There was an error: {e}'
@@ -143,15 +173,6 @@ class StatisticalAnalysis:
     # Additional methods
 
     # Top n differential genes
-    def _gene_generator(self):
-        """
-        Private method (a generator) to avoid saving all differential values in one place.
-
-        """
-        for gene in self.gene_exp_inst.gene_names:
-            yield self.calculate_differential(gene)
-
-
     def top_n_differential(self, n):
         """
         Find top n genes based on differential values.
@@ -160,40 +181,29 @@ class StatisticalAnalysis:
          - n: number of top genes 
 
         Return:
-         - a list (named heap) containing the sorted values
+         - a list of (absolute difference, gene name) tuples,
+           sorted in descending order of the differences
         """
-        heap = []
-        gene_diffs = self._gene_generator()
-
-        for gene_diff in gene_diffs:
-            # gene_diff is a dictionary with gene name as key
-            # and mean difference as value.
-            # Here we want to separate the key and value
-            # in order to create a tuple and use it for heap operations
-            # The indexing [0][0] is because .items() returns a
-            # dict_item type object, when casted as list
-            # it'll return a list of tuples
-            gene_name = list(gene_diff.items())[0][0]
-            diff_val = abs(list(gene_diff.items())[0][1])
+        if n <= 0:
+            return []
 
-            if len(heap) < n:
-                # After adding the element to the end, heappush bubbles up
-                # the element to its correct position in the heap to maintain the heap property
+        diffs = self._mean_differences()
+        if diffs is None:
+            return []
 
-                # By pushing tuples (diff_val, gene_name) onto the heap,
-                # you ensure that the heap maintains the ordering by diff_val,
-                # because it'll look at the first element for ordering
-                # which is crucial for getting the top n elements based on their values.
-                hq.heappush(heap, (diff_val, gene_name))
+        abs_diffs = np.abs(diffs)
+        n = min(n, abs_diffs.size)
 
-            elif diff_val > heap[0][0]:
-                # The new element is inserted in place of the root
-                # and then the heap is adjusted to restore the heap property.
+        # argpartition moves the n largest differences to the end in linear time,
+        # so only those n have to be sorted (in descending order)
+        top = np.argpartition(abs_diffs, -n)[-n:]
+        top = top[np.argsort(abs_diffs[top])[::-1]]
 
-                hq.heapreplace(heap, (diff_val, gene_name))
-
-        # Sort the top N genes in descending order of differential values
-        return sorted(heap, reverse=True, key=lambda x: x[0])
+        # Keep the order (value, name) the report expects. The values are converted
+        # in bulk, indexing abs_diffs one by one would create a numpy scalar per gene
+        gene_names = self.gene_exp_inst.gene_names
+        return [(diff_val, gene_names[i]) for diff_val, i in zip(abs_diffs[top].tolist(),
+                                                                  top.tolist())]
 
 
     # Threshold filtering
@@ -206,8 +216,9 @@ class StatisticalAnalysis:
          - gene_names: Optional specific genes to filter.
 
         Return: 
-        - Dictionary where keys are gene names and values are lists of samples 
-          where the expression is above the threshold. Plus sample name and status(hcc/normal)
+        - Dictionary where keys are gene names and values are ThresholdResults, holding
+          the samples where the expression is above the threshold (with sample name and
+          status(hcc/normal)) and their hcc percentage. Or a message if there are none.
         """
         # To make sure there are no genes repeated
         gene_names = set(gene_names)
@@ -230,40 +241,52 @@ class StatisticalAnalysis:
                 for gene_name in gene_names:
                     self._validate_input(gene_name)
 
-                    # create a dictionarie, with each selected gene names and their values
-                    genes_to_iterate = {gene_name: self.gene_exp_inst.gene_expression_values[gene_name] \
-                                        for gene_name in gene_names}
+                genes_to_iterate = gene_names
             except NoGeneName as e:
                 return f'There was an error: {e}'
 
         else:
             # If no gene name is selected, all gene names are used.
             # NOTE THAT IT WILL TAKE TIME TO GATHER ALL 22278 GENES
-            genes_to_iterate = self.gene_exp_inst.gene_expression_values
+            genes_to_iterate = self.gene_exp_inst.gene_names
 
-        # Create a dictionary of dictionaries, containing the
-        # information about the samples and hcc percentage
-        above_threshold = dict()
-        for gene, samples in genes_to_iterate.items():
-            info, hcc_count, total = defaultdict(list), 0, 0
+        # The columns of the genes, taking all the values avoids copying them
+        # when every gene is used
+        if genes_to_iterate is self.gene_exp_inst.gene_names:
+            gene_values = self.gene_exp_inst.values
+        else:
+            genes_to_iterate = list(genes_to_iterate)
+            gene_values = self.gene_exp_inst.values[:, [self.gene_exp_inst.gene_index[gene]
+                                                         for gene in genes_to_iterate]]
 
-            for sample, status, value in samples:
-                if value > threshold:
+        samples = self.gene_exp_inst.get_sample_array()
+        statuses = self.gene_exp_inst.get_status_array()
+        hcc_mask = self.gene_exp_inst.get_status_codes() == HCC_CODE
 
-                    round_value = round(value, 3)
-                    info['info'].append((sample, status, round_value))
+        # One comparison over all the genes gives a (samples x genes) mask, the number of
+        # samples above the threshold (and how many of them are HCC) is counted per column
+        above = gene_values > threshold
+        totals = np.count_nonzero(above, axis=0).tolist()
+        hcc_counts = np.count_nonzero(above[hcc_mask], axis=0).tolist()
 
-                    total += 1
-                    if status == 'HCC':
-                        hcc_count += 1
+        # Create a dictionary of ThresholdResults, containing the
+        # information about the samples and hcc percentage
+        above_threshold = dict()
+        for j, gene in enumerate(genes_to_iterate):
+            total = totals[j]
 
             # Make sure total values above threshold is not 0 and handle it if it is
             if total != 0:
-                # Set the value of the key (gene) as a dictionary (info)
-                above_threshold[gene] = info
-                above_threshold[gene]['hcc_percentage'] = round(hcc_count/total*100, 3)
+                rows = np.flatnonzero(above[:, j])
+
+                # Only the values above the threshold are rounded, with python's round,
+                # np.round rounds some halfway values like 9.2755 the other way
+                info = list(zip(samples[rows].tolist(), statuses[rows].tolist(),
+                                [round(value, 3) for value in gene_values[rows, j].tolist()]))
+
+                # Set the value of the key (gene) as a ThresholdResult
+                above_threshold[gene] = ThresholdResult(info, round(hcc_counts[j]/total*100, 3))
             else:
                 above_threshold[gene] = 'No expressions above the threshold.'
 
         return above_threshold
-    
\ No newline at end of file